@@ -6,6 +6,7 @@ const axios = require('axios');
 const EnvironmentalDataService = require('./environmental_service');
 const AllergySeverityPredictor = require('./ml_models/prediction_model');
 const DataProcessor = require('./ml_models/data_processor');
+const TTLCache = require('./ttl_cache');
 
 // Load environment variables
 dotenv.config();
@@ -17,10 +18,13 @@ app.use(express.json());
 // Initialize Firebase Admin SDK
 let db = null;
 try {
-    const serviceAccount = require('./firebase_credentials.json');
-    admin.initializeApp({
-        credential: admin.credential.cert(serviceAccount)
-    });
+    // Reuse the default app if this module is loaded more than once
+    if (!admin.apps.length) {
+        const serviceAccount = require('./firebase_credentials.json');
+        admin.initializeApp({
+            credential: admin.credential.cert(serviceAccount)
+        });
+    }
     db = admin.firestore();
     console.log('Firebase initialized successfully');
 } catch (error) {
@@ -28,19 +32,147 @@ try {
     // For development, we can continue without Firebase
 }
 
+// Shared Firestore references, built once instead of per request
+const usersCollection = db ? db.collection('users') : null;
+const { FieldValue } = admin.firestore;
+
 // Initialize ML models and services
 const predictor = new AllergySeverityPredictor();
 const dataProcessor = new DataProcessor();
 const envService = new EnvironmentalDataService();
 
+// Run one fallback prediction at startup so the first request runs warm code
+predictor.predict(dataProcessor.processForPrediction({
+    userData: {},
+    foodLogs: [],
+    environmentalData: []
+}));
+
 // ML Service URL
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://localhost:5001';
 
+// Severity reports read per prediction, newest first. Historical severity
+// features only cover this many subcollection reports (plus any legacy array)
+const SEVERITY_HISTORY_LIMIT = 100;
+
+// User document fields needed for predictions and allergen lookups
+const PREDICTION_USER_FIELDS = ['allergens', 'severity_history', 'food_logs', 'updated_at'];
+const ALLERGEN_USER_FIELDS = ['allergens'];
+const USER_FIELD_MASKS = [null, PREDICTION_USER_FIELDS, ALLERGEN_USER_FIELDS];
+
+// User documents change rarely, so keep recently read ones in memory briefly.
+// The cache is per process: in cluster mode a write only invalidates the
+// worker that handled it, so other workers may serve it for up to the TTL
+const userCache = new TTLCache(10000, 30 * 1000);
+
+/**
+ * Build the user cache key for a document read
+ * @param {string} userId - User ID
+ * @param {Array|null} fieldMask - Fields read, or null for the whole document
+ * @returns {string} Cache key
+ */
+function userCacheKey(userId, fieldMask) {
+    return fieldMask ? `${userId}|${fieldMask.join(',')}` : userId;
+}
+
+/**
+ * Get a user's document data, served from the in-process cache when warm
+ * @param {string} userId - User ID
+ * @param {Array|null} fieldMask - Only transfer these fields, or null for the whole document
+ * @returns {Promise<Object|null>} User data or null if the user does not exist
+ */
+async function getUserData(userId, fieldMask = null) {
+    const cacheKey = userCacheKey(userId, fieldMask);
+    const cached = userCache.get(cacheKey);
+    if (cached !== undefined) {
+        return cached;
+    }
+
+    const userRef = usersCollection.doc(userId);
+    const [userDoc] = fieldMask
+        ? await db.getAll(userRef, { fieldMask })
+        : [await userRef.get()];
+    if (!userDoc.exists) {
+        return null;
+    }
+
+    const userData = userDoc.data();
+    userCache.set(cacheKey, userData);
+    return userData;
+}
+
+/**
+ * Drop every cached read of a user's document
+ * @param {string} userId - User ID
+ */
+function invalidateUserData(userId) {
+    USER_FIELD_MASKS.forEach(fieldMask => userCache.delete(userCacheKey(userId, fieldMask)));
+}
+
+/**
+ * Add an entry to one of a user's log subcollections and bump the user's updated_at
+ * @param {string} userId - User ID
+ * @param {string} collection - Subcollection name
+ * @param {Object} entry - Log entry data
+ * @returns {Promise<void>} Resolves once both writes are committed; rejects
+ *     with NOT_FOUND, writing nothing, if the user doesn't exist
+ */
+async function addUserLogEntry(userId, collection, entry) {
+    const userRef = usersCollection.doc(userId);
+    // Commit both writes atomically: the update fails for unknown users, so
+    // no orphan entry is created. A new updated_at also invalidates cached
+    // predictions for this user
+    const batch = db.batch();
+    batch.update(userRef, { updated_at: FieldValue.serverTimestamp() });
+    batch.create(userRef.collection(collection).doc(), entry);
+    await batch.commit();
+    invalidateUserData(userId);
+}
+
+/**
+ * Convert a stored log timestamp to epoch milliseconds for ordering
+ * @param {Timestamp|Date|string|number} timestamp - Firestore timestamp, Date, ISO string or millis
+ * @returns {number} Epoch milliseconds, or -Infinity when missing or unparseable
+ */
+function timestampMillis(timestamp) {
+    let millis;
+    if (timestamp && typeof timestamp.toMillis === 'function') {
+        millis = timestamp.toMillis();
+    } else if (timestamp instanceof Date) {
+        millis = timestamp.getTime();
+    } else if (typeof timestamp === 'string') {
+        millis = Date.parse(timestamp);
+    } else if (typeof timestamp === 'number') {
+        millis = timestamp;
+    }
+    return Number.isFinite(millis) ? millis : -Infinity;
+}
+
+// Predictions for unchanged inputs are reused for a minute
+const predictionCache = new TTLCache(1024, 60 * 1000);
+
+/**
+ * Build the prediction cache key for a user's current document state
+ * @param {string} userId - User ID
+ * @param {Object} userData - User document data
+ * @returns {string} Cache key
+ */
+function predictionCacheKey(userId, userData) {
+    // Older or client-written documents may lack updated_at or store it as a string
+    const updatedAt = timestampMillis(userData.updated_at);
+    // The mobile app appends severity_history and edits allergens directly
+    // without touching updated_at
+    const legacyReports = (userData.severity_history || []).length;
+    const allergens = JSON.stringify(userData.allergens || []);
+    return `${userId}:${updatedAt}:${legacyReports}:${allergens}`;
+}
+
 // Health check endpoint
 app.get('/health', (req, res) => {
     res.json({
         status: 'healthy',
-        timestamp: new Date().toISOString()
+        timestamp: new Date().toISOString(),
+        environmental_cache: envService.getCacheStats()
     });
 });
 
@@ -57,14 +189,12 @@ app.post('/api/users/register', async (req, res) => {
         });
 
         // Create user document in Firestore
-        const userRef = db.collection('users').doc(userRecord.uid);
+        const userRef = usersCollection.doc(userRecord.uid);
         await userRef.set({
             name,
             email,
             allergens,
-            severity_history: [],
-            food_logs: [],
-            created_at: admin.firestore.FieldValue.serverTimestamp()
+            created_at: FieldValue.serverTimestamp()
         });
 
         res.status(201).json({
@@ -84,19 +214,17 @@ app.post('/api/users/register', async (req, res) => {
 app.get('/api/users/profile/:user_id', async (req, res) => {
     try {
         const { user_id } = req.params;
-        const userRef = db.collection('users').doc(user_id);
-        const userDoc = await userRef.get();
+        const cachedUserData = await getUserData(user_id);
 
-        if (!userDoc.exists) {
+        if (!cachedUserData) {
             return res.status(404).json({
                 success: false,
                 error: 'User not found'
             });
         }
 
-        const userData = userDoc.data();
-        // Remove sensitive info
-        delete userData.password;
+        // Remove sensitive info without touching the cached copy
+        const { password, ...userData } = cachedUserData;
 
         res.json({
             success: true,
@@ -122,19 +250,15 @@ app.post('/api/food/log', async (req, res) => {
             });
         }
 
-        // Get user document
-        const userRef = db.collection('users').doc(userId);
-
         // Add food log with timestamp
         const foodLog = {
             items: foodItems,
-            timestamp: admin.firestore.FieldValue.serverTimestamp(),
+            timestamp: FieldValue.serverTimestamp(),
             notes
         };
 
-        await userRef.update({
-            food_logs: admin.firestore.FieldValue.arrayUnion(foodLog)
-        });
+        // Store in food_logs subcollection so each log is a constant-size write
+        await addUserLogEntry(userId, 'food_logs', foodLog);
 
         res.json({
             success: true,
@@ -160,17 +284,14 @@ app.post('/api/environment/log', async (req, res) => {
             });
         }
 
-        // Get user document
-        const userRef = db.collection('users').doc(userId);
-
         // Add environmental log with timestamp
         const envLog = {
             data: environmentData,
-            timestamp: admin.firestore.FieldValue.serverTimestamp()
+            timestamp: FieldValue.serverTimestamp()
         };
 
         // Store in environment_logs subcollection
-        await userRef.collection('environment_logs').add(envLog);
+        await addUserLogEntry(userId, 'environment_logs', envLog);
 
         res.json({
             success: true,
@@ -184,6 +305,17 @@ app.post('/api/environment/log', async (req, res) => {
     }
 });
 
+// Mock prediction returned when Firebase is not available; only the timestamp varies
+const MOCK_PREDICTION_BODY = JSON.stringify({
+    success: true,
+    prediction: {
+        risk_level: 6.5,
+        confidence: 0.78,
+        contributing_factors: ['High pollen count', 'Recent food allergen exposure'],
+        timestamp: '__TIMESTAMP__'
+    }
+});
+
 // Predict allergy risk
 app.post('/api/predict/allergy-risk', async (req, res) => {
     try {
@@ -199,43 +331,64 @@ app.post('/api/predict/allergy-risk', async (req, res) => {
         // Check if Firebase is available
         if (!db) {
             // Return mock prediction data when Firebase is not available
-            return res.json({
-                success: true,
-                prediction: {
-                    risk_level: 6.5,
-                    confidence: 0.78,
-                    contributing_factors: ['High pollen count', 'Recent food allergen exposure'],
-                    timestamp: new Date().toISOString()
-                }
-            });
+            return res
+                .type('application/json')
+                .send(MOCK_PREDICTION_BODY.replace('__TIMESTAMP__', new Date().toISOString()));
         }
 
-        // Get user data
-        const userRef = db.collection('users').doc(userId);
-        const userDoc = await userRef.get();
+        // Reuse the last prediction while the user's inputs are unchanged
+        const warmUserData = userCache.get(userCacheKey(userId, PREDICTION_USER_FIELDS));
+        if (warmUserData) {
+            const cachedPrediction = predictionCache.get(predictionCacheKey(userId, warmUserData));
+            if (cachedPrediction) {
+                return res.json({
+                    success: true,
+                    prediction: {
+                        ...cachedPrediction,
+                        timestamp: new Date().toISOString()
+                    }
+                });
+            }
+        }
 
-        if (!userDoc.exists) {
+        // Fetch user data, recent food logs (last 5), severity history and
+        // environmental data (last 3 entries) concurrently
+        const userRef = usersCollection.doc(userId);
+        const recentLogs = (collection, limit) => userRef
+            .collection(collection)
+            .orderBy('timestamp', 'desc')
+            .limit(limit)
+            .get();
+        const [storedUserData, foodLogsSnapshot, severitySnapshot, envLogsSnapshot] = await Promise.all([
+            getUserData(userId, PREDICTION_USER_FIELDS),
+            recentLogs('food_logs', 5),
+            recentLogs('severity_history', SEVERITY_HISTORY_LIMIT),
+            recentLogs('environment_logs', 3)
+        ]);
+
+        if (!storedUserData) {
             return res.status(404).json({
                 success: false,
                 error: 'User not found'
             });
         }
 
-        const userData = userDoc.data();
-
-        // Get recent food logs (last 5)
-        const foodLogs = (userData.food_logs || []).slice(-5);
-
-        // Get environmental data (last 3 entries)
-        const envLogsSnapshot = await userRef
-            .collection('environment_logs')
-            .orderBy('timestamp', 'desc')
-            .limit(3)
-            .get();
+        // The mobile app still appends to arrays on the user document, so merge
+        // those with the subcollection entries and sort everything by time
+        const chronological = (legacyEntries, snapshot) => [
+            ...(legacyEntries || []),
+            ...snapshot.docs.map(doc => doc.data())
+        ].sort((a, b) => timestampMillis(a.timestamp) - timestampMillis(b.timestamp));
+        const foodLogs = chronological(storedUserData.food_logs, foodLogsSnapshot).slice(-5);
+        const userData = {
+            ...storedUserData,
+            severity_history: chronological(storedUserData.severity_history, severitySnapshot)
+        };
 
         const envData = envLogsSnapshot.docs.map(doc => doc.data());
 
         // Try to use Python ML service first, fallback to Node.js predictor
+        let prediction = null;
         try {
             const mlResponse = await axios.post(
                 `${ML_SERVICE_URL}/api/predict/allergy-risk`,
@@ -248,36 +401,39 @@ app.post('/api/predict/allergy-risk', async (req, res) => {
             );
 
             if (mlResponse.data.success) {
-                return res.json({
-                    success: true,
-                    prediction: {
-                        ...mlResponse.data.prediction,
-                        timestamp: new Date().toISOString(),
-                        model_type: 'scikit-learn'
-                    }
-                });
+                prediction = {
+                    ...mlResponse.data.prediction,
+                    model_type: 'scikit-learn'
+                };
             }
         } catch (mlError) {
             console.log('ML service unavailable, using fallback predictor');
         }
 
-        // Fallback to Node.js predictor
-        const processedData = dataProcessor.processForPrediction({
-            userData,
-            foodLogs,
-            environmentalData: envData
-        });
+        if (!prediction) {
+            // Fallback to Node.js predictor
+            const processedData = dataProcessor.processForPrediction({
+                userData,
+                foodLogs,
+                environmentalData: envData
+            });
 
-        const prediction = predictor.predict(processedData);
+            const fallbackPrediction = predictor.predict(processedData);
+            prediction = {
+                risk_level: fallbackPrediction.risk_level,
+                confidence: fallbackPrediction.confidence,
+                contributing_factors: fallbackPrediction.contributing_factors,
+                model_type: 'fallback'
+            };
+        }
+
+        predictionCache.set(predictionCacheKey(userId, storedUserData), prediction);
 
         res.json({
             success: true,
             prediction: {
-                risk_level: parseFloat(prediction.risk_level),
-                confidence: parseFloat(prediction.confidence),
-                contributing_factors: prediction.contributing_factors,
-                timestamp: new Date().toISOString(),
-                model_type: 'fallback'
+                ...prediction,
+                timestamp: new Date().toISOString()
             }
         });
     } catch (error) {
@@ -305,14 +461,11 @@ app.post('/api/allergy/report', async (req, res) => {
             severity,
             symptoms,
             notes,
-            timestamp: admin.firestore.FieldValue.serverTimestamp()
+            timestamp: FieldValue.serverTimestamp()
         };
 
-        // Add to user's severity history
-        const userRef = db.collection('users').doc(userId);
-        await userRef.update({
-            severity_history: admin.firestore.FieldValue.arrayUnion(report)
-        });
+        // Add to user's severity_history subcollection
+        await addUserLogEntry(userId, 'severity_history', report);
 
         // This reported data will be used to retrain and improve the model
 
@@ -328,6 +481,43 @@ app.post('/api/allergy/report', async (req, res) => {
     }
 });
 
+// For now, analysis endpoints return mock data - you can implement real analysis later.
+// The bodies are constant, so serialize them once at startup.
+const TEMPORAL_PATTERNS_BODY = JSON.stringify({
+    success: true,
+    patterns: {
+        daily_pattern: {
+            '8': 6.2,
+            '12': 4.5,
+            '18': 7.1,
+            '22': 5.8
+        },
+        monthly_pattern: {
+            '1': 3.5,
+            '4': 7.2,
+            '7': 5.1,
+            '10': 6.8
+        },
+        has_seasonal_pattern: true,
+        seasonal_severity: {
+            spring: 7.2,
+            summer: 5.1,
+            fall: 6.8,
+            winter: 3.5
+        }
+    }
+});
+
+const RISK_FACTORS_BODY = JSON.stringify({
+    success: true,
+    riskFactors: [
+        { factor: 'Pollen Count', weight: 0.35 },
+        { factor: 'Food Allergens', weight: 0.28 },
+        { factor: 'Weather Changes', weight: 0.22 },
+        { factor: 'Time of Day', weight: 0.15 }
+    ]
+});
+
 // Get temporal patterns
 app.post('/api/analysis/temporal-patterns', async (req, res) => {
     try {
@@ -340,33 +530,7 @@ app.post('/api/analysis/temporal-patterns', async (req, res) => {
             });
         }
 
-        // For now, return mock data - you can implement real analysis later
-        const patterns = {
-            daily_pattern: {
-                '8': 6.2,
-                '12': 4.5,
-                '18': 7.1,
-                '22': 5.8
-            },
-            monthly_pattern: {
-                '1': 3.5,
-                '4': 7.2,
-                '7': 5.1,
-                '10': 6.8
-            },
-            has_seasonal_pattern: true,
-            seasonal_severity: {
-                spring: 7.2,
-                summer: 5.1,
-                fall: 6.8,
-                winter: 3.5
-            }
-        };
-
-        res.json({
-            success: true,
-            patterns
-        });
+        res.type('application/json').send(TEMPORAL_PATTERNS_BODY);
     } catch (error) {
         res.status(500).json({
             success: false,
@@ -387,18 +551,7 @@ app.post('/api/analysis/risk-factors', async (req, res) => {
             });
         }
 
-        // For now, return mock data - you can implement real analysis later
-        const riskFactors = [
-            { factor: 'Pollen Count', weight: 0.35 },
-            { factor: 'Food Allergens', weight: 0.28 },
-            { factor: 'Weather Changes', weight: 0.22 },
-            { factor: 'Time of Day', weight: 0.15 }
-        ];
-
-        res.json({
-            success: true,
-            riskFactors
-        });
+        res.type('application/json').send(RISK_FACTORS_BODY);
     } catch (error) {
         res.status(500).json({
             success: false,
@@ -411,18 +564,14 @@ app.post('/api/analysis/risk-factors', async (req, res) => {
 app.post('/api/environmental/current', async (req, res) => {
     try {
         const { latitude, longitude } = req.body;
-        console.log(`Received request data:`, req.body);
-        console.log(`Extracted coordinates: lat=${latitude}, lon=${longitude}`);
 
         if (!latitude || !longitude) {
-            console.log('Missing coordinates!');
             return res.status(400).json({
                 success: false,
                 error: 'Latitude and longitude are required'
             });
         }
 
-        console.log(`Calling environmental service with lat=${latitude}, lon=${longitude}`);
         // Get comprehensive environmental data
         const environmentalData = await envService.getComprehensiveEnvironmentalData(
             parseFloat(latitude),
@@ -453,26 +602,28 @@ app.post('/api/environmental/risk-assessment', async (req, res) => {
             });
         }
 
-        // Get environmental data
-        const environmentalData = await envService.getComprehensiveEnvironmentalData(
-            parseFloat(latitude),
-            parseFloat(longitude)
-        );
-
         // Get user allergens if userId provided
-        let userAllergens = [];
-        if (userId && db) {
+        const getUserAllergens = async () => {
+            if (!userId || !db) {
+                return [];
+            }
             try {
-                const userRef = db.collection('users').doc(userId);
-                const userDoc = await userRef.get();
-                if (userDoc.exists) {
-                    const userData = userDoc.data();
-                    userAllergens = userData.allergens || [];
-                }
+                const userData = await getUserData(userId, ALLERGEN_USER_FIELDS);
+                return (userData && userData.allergens) || [];
             } catch (error) {
                 console.log(`Could not fetch user allergens: ${error.message}`);
+                return [];
             }
-        }
+        };
+
+        // Get environmental data and user allergens concurrently
+        const [environmentalData, userAllergens] = await Promise.all([
+            envService.getComprehensiveEnvironmentalData(
+                parseFloat(latitude),
+                parseFloat(longitude)
+            ),
+            getUserAllergens()
+        ]);
 
         // Get risk assessment
         const riskAssessment = envService.getAllergyRiskAssessment(
@@ -551,11 +702,42 @@ app.post('/api/environmental/air-quality', async (req, res) => {
     }
 });
 
-// Start the server
-const PORT = process.env.PORT || 5000;
-app.listen(PORT, '0.0.0.0', () => {
-    console.log(`Server running on port ${PORT}`);
-});
+// In-flight requests get this long to finish on shutdown before exiting anyway
+const SHUTDOWN_TIMEOUT_MS = 10 * 1000;
+
+/**
+ * Start listening for requests, shutting down gracefully on SIGTERM/SIGINT
+ * @returns {http.Server} The listening server
+ */
+function startServer() {
+    const PORT = process.env.PORT || 5000;
+    const server = app.listen(PORT, '0.0.0.0', () => {
+        console.log(`Server running on port ${PORT} (pid ${process.pid})`);
+    });
+
+    // Stop accepting requests, let in-flight ones finish, then release pooled
+    // upstream connections. 'exit' handlers don't run on these signals
+    const shutdown = () => {
+        server.close(() => {
+            envService.close();
+            process.exit(0);
+        });
+        if (server.closeIdleConnections) {
+            server.closeIdleConnections();
+        }
+        setTimeout(() => process.exit(1), SHUTDOWN_TIMEOUT_MS).unref();
+    };
+    process.once('SIGTERM', shutdown);
+    process.once('SIGINT', shutdown);
+
+    return server;
+}
+
+// Start the server when run directly; server.js runs it in cluster workers
+if (require.main === module) {
+    startServer();
+}
 
 module.exports = app;
+module.exports.startServer = startServer;
 
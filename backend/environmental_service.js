@@ -1,4 +1,53 @@
 const axios = require('axios');
+const http = require('http');
+const https = require('https');
+const util = require('util');
+const TTLCache = require('./ttl_cache');
+
+// Per-request tracing, enabled with NODE_DEBUG=environmental; arguments are
+// only formatted when it is on
+const debug = util.debuglog('environmental');
+
+// Keep-alive connection pools shared by every service instance, so upstream
+// calls skip the TCP/TLS handshake
+const httpAgent = new http.Agent({ keepAlive: true, maxSockets: 50 });
+const httpsAgent = new https.Agent({ keepAlive: true, maxSockets: 50 });
+
+// Transient upstream failures are retried with exponential backoff plus jitter
+const MAX_RETRIES = 3;
+const RETRY_BACKOFF_MS = 1000;
+const RETRY_JITTER_MS = 500;
+const RETRYABLE_STATUS_CODES = new Set([429, 500, 502, 503, 504]);
+// Transient network failures worth retrying; anything else (cancellation,
+// request timeouts, config or programming errors) is rethrown immediately
+const RETRYABLE_ERROR_CODES = new Set([
+    'ECONNRESET', 'ETIMEDOUT', 'EAI_AGAIN', 'ECONNREFUSED', 'ENOTFOUND', 'EPIPE'
+]);
+// Give up instead of waiting when the upstream asks for a longer Retry-After,
+// since deduplicated callers for the same location all wait on the retry
+const MAX_RETRY_DELAY_MS = 5000;
+
+// Upstream responses are reused for 5 minutes per ~1 km grid cell
+const LOCATION_CACHE_SIZE = 4096;
+const LOCATION_CACHE_TTL_MS = 5 * 60 * 1000;
+
+// Environmental risk rules, evaluated in order: [predicate, factor label, score]
+const RISK_RULES = [
+    [env => (env.air_quality?.aqi || 1) >= 3, 'Poor air quality', 2],
+    [env => (env.pollen?.total_pollen_count || 0) > 50, 'High pollen count', 3],
+    [env => (env.weather?.humidity || 50) > 70, 'High humidity', 1],
+    [env => (env.weather?.wind_speed || 0) > 10, 'Strong winds (dispersing allergens)', 1]
+];
+
+// Static but realistic pollen readings until a pollen API is integrated
+const STATIC_POLLEN_DATA = Object.freeze({
+    tree_pollen: 2,
+    grass_pollen: 1,
+    weed_pollen: 1,
+    total_pollen_count: 35,
+    dominant_pollen_type: 'tree',
+    risk_level: 'moderate'
+});
 
 class EnvironmentalDataService {
     /**
@@ -12,6 +61,134 @@ class EnvironmentalDataService {
         // API endpoints
         this.openweatherBaseUrl = 'http://api.openweathermap.org/data/2.5';
         this.airQualityBaseUrl = 'http://api.openweathermap.org/data/2.5/air_pollution';
+
+        // Pooled client for all OpenWeatherMap requests
+        this.httpClient = axios.create({
+            httpAgent,
+            httpsAgent,
+            timeout: 15000 // 15 seconds timeout
+        });
+
+        // Per-component caches so a miss on one source does not refetch the other
+        this.weatherCache = new TTLCache(LOCATION_CACHE_SIZE, LOCATION_CACHE_TTL_MS);
+        this.airQualityCache = new TTLCache(LOCATION_CACHE_SIZE, LOCATION_CACHE_TTL_MS);
+
+        // Upstream requests in flight, shared by concurrent misses for the same cell
+        this.pendingRequests = new Map();
+    }
+
+    /**
+     * Get hit/miss statistics for the upstream response caches
+     * @returns {Object} Cache statistics per data kind
+     */
+    getCacheStats() {
+        return {
+            weather: this.weatherCache.stats(),
+            air_quality: this.airQualityCache.stats()
+        };
+    }
+
+    /**
+     * Close pooled upstream connections
+     */
+    close() {
+        httpAgent.destroy();
+        httpsAgent.destroy();
+    }
+
+    /**
+     * GET an upstream URL, retrying transient failures
+     * Retries 429/5xx responses and connection errors (not the 15 second
+     * request timeout), honoring Retry-After when the server sends it.
+     * @param {string} url - Request URL
+     * @param {Object} params - Query parameters
+     * @returns {Promise<Object>} axios response
+     */
+    async _getWithRetry(url, params) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await this.httpClient.get(url, { params });
+            } catch (error) {
+                const status = error.response ? error.response.status : null;
+                const retryable = status
+                    ? RETRYABLE_STATUS_CODES.has(status)
+                    : RETRYABLE_ERROR_CODES.has(error.code);
+                if (!retryable || attempt >= MAX_RETRIES) {
+                    throw error;
+                }
+
+                const delay = this._retryDelay(error, attempt);
+                if (delay > MAX_RETRY_DELAY_MS) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, delay));
+            }
+        }
+    }
+
+    /**
+     * Get the wait before the next retry attempt
+     * @param {Error} error - Error from the failed attempt
+     * @param {number} attempt - Zero-based index of the failed attempt
+     * @returns {number} Delay in milliseconds
+     */
+    _retryDelay(error, attempt) {
+        const retryAfter = error.response && error.response.headers['retry-after'];
+        if (retryAfter) {
+            // Retry-After is either a number of seconds or an HTTP date
+            const seconds = Number(retryAfter);
+            const delay = Number.isNaN(seconds) ? Date.parse(retryAfter) - Date.now() : seconds * 1000;
+            if (delay >= 0) {
+                return delay;
+            }
+        }
+        return RETRY_BACKOFF_MS * 2 ** attempt + Math.random() * RETRY_JITTER_MS;
+    }
+
+    /**
+     * Serve location data from cache, fetching it upstream at most once at a time
+     * @param {TTLCache} cache - Cache for this kind of data
+     * @param {string} kind - Data kind, used to key in-flight requests
+     * @param {number} lat - Latitude
+     * @param {number} lon - Longitude
+     * @param {Function} fetchData - Called with (lat, lon) on a cache miss
+     * @returns {Promise<Object|null>} Cached or freshly fetched data
+     */
+    async _getCachedLocationData(cache, kind, lat, lon, fetchData) {
+        // Two decimal places is roughly a 1 km grid
+        const cellKey = `${lat.toFixed(2)},${lon.toFixed(2)}`;
+        const cached = cache.get(cellKey);
+        if (cached !== undefined) {
+            return cached;
+        }
+
+        const pendingKey = `${kind}:${cellKey}`;
+        let pending = this.pendingRequests.get(pendingKey);
+        if (!pending) {
+            pending = fetchData(lat, lon)
+                .then(data => {
+                    // Failed fetches return null and are retried on the next request
+                    if (data) {
+                        cache.set(cellKey, data);
+                    }
+                    return data;
+                })
+                .finally(() => this.pendingRequests.delete(pendingKey));
+            this.pendingRequests.set(pendingKey, pending);
+        }
+        return pending;
+    }
+
+    /**
+     * Get current weather data, cached per location
+     * @param {number} lat - Latitude
+     * @param {number} lon - Longitude
+     * @returns {Promise<Object|null>} Weather data or null
+     */
+    getWeatherData(lat, lon) {
+        return this._getCachedLocationData(
+            this.weatherCache, 'weather', lat, lon, (la, lo) => this._fetchWeatherData(la, lo)
+        );
     }
 
     /**
@@ -20,12 +197,12 @@ class EnvironmentalDataService {
      * @param {number} lon - Longitude
      * @returns {Promise<Object|null>} Weather data or null
      */
-    async getWeatherData(lat, lon) {
-        console.log(`Attempting to fetch weather data for lat=${lat}, lon=${lon}`);
-        console.log(`OpenWeather API key present: ${!!this.openweatherApiKey}`);
+    async _fetchWeatherData(lat, lon) {
+        debug('Attempting to fetch weather data for lat=%s, lon=%s', lat, lon);
+        debug('OpenWeather API key present: %s', !!this.openweatherApiKey);
 
         if (!this.openweatherApiKey) {
-            console.log('ERROR: No OpenWeather API key found in environment variables!');
+            console.error('ERROR: No OpenWeather API key found in environment variables!');
             return null;
         }
 
@@ -38,14 +215,11 @@ class EnvironmentalDataService {
         };
 
         try {
-            console.log(`Making API request to: ${url}`);
-            const response = await axios.get(url, {
-                params,
-                timeout: 15000 // 15 seconds timeout
-            });
+            debug('Making API request to: %s', url);
+            const response = await this._getWithRetry(url, params);
 
-            console.log(`API Response status: ${response.status}`);
-            console.log('Successfully fetched real weather data!');
+            debug('API Response status: %s', response.status);
+            debug('Successfully fetched real weather data!');
 
             const data = response.data;
             return {
@@ -61,30 +235,42 @@ class EnvironmentalDataService {
             };
         } catch (error) {
             if (error.code === 'ECONNABORTED') {
-                console.log('TIMEOUT: Weather API request timed out after 15 seconds');
+                console.error('TIMEOUT: Weather API request timed out after 15 seconds');
             } else if (error.code === 'ECONNREFUSED' || error.code === 'ENOTFOUND') {
-                console.log('CONNECTION ERROR: Could not connect to weather API');
+                console.error('CONNECTION ERROR: Could not connect to weather API');
             } else {
-                console.log(`REQUEST ERROR fetching weather data: ${error.message}`);
+                console.error(`REQUEST ERROR fetching weather data: ${error.message}`);
                 if (error.response) {
-                    console.log(`Response content: ${JSON.stringify(error.response.data)}`);
+                    console.error(`Response content: ${JSON.stringify(error.response.data)}`);
                 }
             }
             return null;
         }
     }
 
+    /**
+     * Get air quality data, cached per location
+     * @param {number} lat - Latitude
+     * @param {number} lon - Longitude
+     * @returns {Promise<Object|null>} Air quality data or null
+     */
+    getAirQualityData(lat, lon) {
+        return this._getCachedLocationData(
+            this.airQualityCache, 'air_quality', lat, lon, (la, lo) => this._fetchAirQualityData(la, lo)
+        );
+    }
+
     /**
      * Fetch air quality data from OpenWeatherMap Air Pollution API
      * @param {number} lat - Latitude
      * @param {number} lon - Longitude
      * @returns {Promise<Object|null>} Air quality data or null
      */
-    async getAirQualityData(lat, lon) {
-        console.log(`Attempting to fetch air quality data for lat=${lat}, lon=${lon}`);
+    async _fetchAirQualityData(lat, lon) {
+        debug('Attempting to fetch air quality data for lat=%s, lon=%s', lat, lon);
 
         if (!this.openweatherApiKey) {
-            console.log('ERROR: No OpenWeather API key found for air quality!');
+            console.error('ERROR: No OpenWeather API key found for air quality!');
             return null;
         }
 
@@ -96,19 +282,16 @@ class EnvironmentalDataService {
         };
 
         try {
-            console.log(`Making air quality API request to: ${url}`);
-            const response = await axios.get(url, {
-                params,
-                timeout: 15000 // 15 seconds timeout
-            });
+            debug('Making air quality API request to: %s', url);
+            const response = await this._getWithRetry(url, params);
 
-            console.log(`Air quality API Response status: ${response.status}`);
+            debug('Air quality API Response status: %s', response.status);
 
             const data = response.data;
             if (data.list && data.list.length > 0) {
                 const airData = data.list[0];
                 const components = airData.components;
-                console.log('Successfully fetched real air quality data!');
+                debug('Successfully fetched real air quality data!');
 
                 return {
                     aqi: airData.main.aqi, // 1-5 scale
@@ -123,17 +306,17 @@ class EnvironmentalDataService {
                 };
             }
 
-            console.log('No air quality data in response');
+            console.warn('No air quality data in response');
             return null;
         } catch (error) {
             if (error.code === 'ECONNABORTED') {
-                console.log('TIMEOUT: Air quality API request timed out after 15 seconds');
+                console.error('TIMEOUT: Air quality API request timed out after 15 seconds');
             } else if (error.code === 'ECONNREFUSED' || error.code === 'ENOTFOUND') {
-                console.log('CONNECTION ERROR: Could not connect to air quality API');
+                console.error('CONNECTION ERROR: Could not connect to air quality API');
             } else {
-                console.log(`REQUEST ERROR fetching air quality data: ${error.message}`);
+                console.error(`REQUEST ERROR fetching air quality data: ${error.message}`);
                 if (error.response) {
-                    console.log(`Response content: ${JSON.stringify(error.response.data)}`);
+                    console.error(`Response content: ${JSON.stringify(error.response.data)}`);
                 }
             }
             return null;
@@ -147,17 +330,8 @@ class EnvironmentalDataService {
      * @returns {Object} Pollen data
      */
     getPollenData(lat, lon) {
-        console.log('Using static pollen data (real pollen APIs are typically paid)');
-        // Return static but realistic pollen data for now
-        return {
-            tree_pollen: 2,
-            grass_pollen: 1,
-            weed_pollen: 1,
-            total_pollen_count: 35,
-            dominant_pollen_type: 'tree',
-            risk_level: 'moderate',
-            timestamp: new Date().toISOString()
-        };
+        debug('Using static pollen data (real pollen APIs are typically paid)');
+        return { ...STATIC_POLLEN_DATA, timestamp: new Date().toISOString() };
     }
 
     /**
@@ -167,18 +341,22 @@ class EnvironmentalDataService {
      * @returns {Promise<Object>} Comprehensive environmental data
      */
     async getComprehensiveEnvironmentalData(lat, lon) {
-        console.log(`Getting comprehensive environmental data for lat=${lat}, lon=${lon}`);
-
-        const weatherData = await this.getWeatherData(lat, lon);
-        const airQualityData = await this.getAirQualityData(lat, lon);
+        debug('Getting comprehensive environmental data for lat=%s, lon=%s', lat, lon);
+
+        // Weather and air quality are independent upstream calls; each resolves
+        // to null on failure, so one failing source doesn't affect the other
+        const [weatherData, airQualityData] = await Promise.all([
+            this.getWeatherData(lat, lon),
+            this.getAirQualityData(lat, lon)
+        ]);
         const pollenData = this.getPollenData(lat, lon);
 
         // Check if we got real data
         if (!weatherData) {
-            console.log('ERROR: Failed to get weather data - check your OPENWEATHER_API_KEY');
+            console.error('ERROR: Failed to get weather data - check your OPENWEATHER_API_KEY');
         }
         if (!airQualityData) {
-            console.log('ERROR: Failed to get air quality data - check your OPENWEATHER_API_KEY');
+            console.error('ERROR: Failed to get air quality data - check your OPENWEATHER_API_KEY');
         }
 
         return {
@@ -203,33 +381,11 @@ class EnvironmentalDataService {
         const riskFactors = [];
         let riskScore = 0;
 
-        // Air quality impact
-        const aqi = environmentalData.air_quality?.aqi || 1;
-        if (aqi >= 3) {
-            riskFactors.push('Poor air quality');
-            riskScore += 2;
-        }
-
-        // Pollen impact
-        const pollenData = environmentalData.pollen || {};
-        const totalPollenCount = pollenData.total_pollen_count || 0;
-        if (totalPollenCount > 50) {
-            riskFactors.push('High pollen count');
-            riskScore += 3;
-        }
-
-        // Weather impact
-        const weather = environmentalData.weather || {};
-        const humidity = weather.humidity || 50;
-        if (humidity > 70) {
-            riskFactors.push('High humidity');
-            riskScore += 1;
-        }
-
-        const windSpeed = weather.wind_speed || 0;
-        if (windSpeed > 10) {
-            riskFactors.push('Strong winds (dispersing allergens)');
-            riskScore += 1;
+        for (const [applies, label, score] of RISK_RULES) {
+            if (applies(environmentalData)) {
+                riskFactors.push(label);
+                riskScore += score;
+            }
         }
 
         // Determine risk level
@@ -248,7 +404,7 @@ class EnvironmentalDataService {
             risk_level: riskLevel,
             risk_score: riskScore,
             contributing_factors: riskFactors,
-            recommendations: this._getRecommendations(riskLevel, riskFactors),
+            recommendations: this._getRecommendations(riskLevel, new Set(riskFactors)),
             assessment_time: new Date().toISOString()
         };
     }
@@ -256,7 +412,7 @@ class EnvironmentalDataService {
     /**
      * Get personalized recommendations based on risk assessment
      * @param {string} riskLevel - Risk level (low, moderate, high, very_high)
-     * @param {Array} riskFactors - Array of risk factors
+     * @param {Set} riskFactors - Set of risk factors
      * @returns {Array} Recommendations
      */
     _getRecommendations(riskLevel, riskFactors) {
@@ -268,17 +424,17 @@ class EnvironmentalDataService {
             recommendations.push('Take allergy medication as prescribed');
         }
 
-        if (riskFactors.includes('High pollen count')) {
+        if (riskFactors.has('High pollen count')) {
             recommendations.push('Shower and change clothes after being outside');
             recommendations.push('Avoid outdoor activities like gardening');
         }
 
-        if (riskFactors.includes('Poor air quality')) {
+        if (riskFactors.has('Poor air quality')) {
             recommendations.push('Wear a mask if you must go outside');
             recommendations.push('Avoid outdoor exercise');
         }
 
-        if (riskFactors.includes('High humidity')) {
+        if (riskFactors.has('High humidity')) {
             recommendations.push('Use a dehumidifier indoors');
             recommendations.push('Check for mold and mildew growth');
         }
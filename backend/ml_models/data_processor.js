@@ -1,3 +1,8 @@
+// Epoch milliseconds of parsed ISO timestamp strings, shared across calls since
+// the same log entries are analyzed repeatedly
+const TIMESTAMP_CACHE_SIZE = 8192;
+const parsedTimestamps = new Map();
+
 class DataProcessor {
     constructor() {
         // Known allergens and their typical severity scores for reference
@@ -16,10 +21,11 @@ class DataProcessor {
 
     /**
      * Process user, food, and environmental data for prediction
-     * @param {Object} options - Options containing userData, foodLogs, and environmentalData
+     * @param {Object} options - Options containing userData, foodLogs, and environmentalData,
+     *     plus includeFrequency to also count food frequencies (unused by the predictor)
      * @returns {Object} Processed data for prediction
      */
-    processForPrediction({ userData, foodLogs, environmentalData }) {
+    processForPrediction({ userData, foodLogs, environmentalData, includeFrequency = false }) {
         // Process user allergens
         const allergens = userData.allergens || [];
 
@@ -34,36 +40,75 @@ class DataProcessor {
             }
         });
 
-        // Count food frequencies
-        const foodCounts = {};
-        recentFoodItems.forEach(food => {
-            foodCounts[food] = (foodCounts[food] || 0) + 1;
-        });
+        // Count food frequencies, only for callers that analyze them
+        let foodCounts;
+        if (includeFrequency) {
+            foodCounts = {};
+            recentFoodItems.forEach(food => {
+                foodCounts[food] = (foodCounts[food] || 0) + 1;
+            });
+        }
 
         // Identify risky foods (foods that match user allergens)
-        const riskyFoods = recentFoodItems.filter(food => allergens.includes(food));
+        const allergenSet = new Set(allergens);
+        const riskyFoods = recentFoodItems.filter(food => allergenSet.has(food));
 
         // Get most recent environmental data
         const latestEnvData = environmentalData.length > 0 ? environmentalData[0] : {};
 
         // Combine all processed data
-        return {
+        const processed = {
             allergens,
             severity_history: severityHistory,
             food_logs: foodLogs,
             environmental_data: environmentalData,
             // Add additional processed features
-            food_frequency: foodCounts,
             risky_foods: riskyFoods
         };
+        if (foodCounts) {
+            processed.food_frequency = foodCounts;
+        }
+        return processed;
+    }
+
+    /**
+     * Parse severity history and food logs once so several analyses can share the result
+     * @param {Array} severityHistory - Array of severity reports
+     * @param {Array} foodLogs - Array of food logs
+     * @returns {Object} Severity times and levels, plus one time and item per logged food
+     */
+    prepareHistory(severityHistory = [], foodLogs = []) {
+        const severityTimes = [];
+        const severities = [];
+        (severityHistory || []).forEach(report => {
+            if (report.timestamp) {
+                severityTimes.push(this._parseTime(report.timestamp));
+                severities.push(report.severity);
+            }
+        });
+
+        const foodTimes = [];
+        const foodItems = [];
+        (foodLogs || []).forEach(log => {
+            if (log.timestamp && log.items) {
+                const time = this._parseTime(log.timestamp);
+                log.items.forEach(item => {
+                    foodTimes.push(time);
+                    foodItems.push(item);
+                });
+            }
+        });
+
+        return { severityTimes, severities, foodTimes, foodItems };
     }
 
     /**
      * Extract temporal patterns from severity history
      * @param {Array} severityHistory - Array of severity reports
+     * @param {Object} prepared - Output of prepareHistory, parsed here if omitted
      * @returns {Object} Temporal patterns
      */
-    extractTemporalPatterns(severityHistory) {
+    extractTemporalPatterns(severityHistory, prepared = this.prepareHistory(severityHistory)) {
         if (!severityHistory || severityHistory.length === 0) {
             return {
                 daily_pattern: {},
@@ -72,31 +117,9 @@ class DataProcessor {
             };
         }
 
-        // Convert timestamps to Date objects
-        const timestamps = [];
-        const severities = [];
-
-        severityHistory.forEach(report => {
-            if (report.timestamp) {
-                let ts;
-                if (typeof report.timestamp === 'string') {
-                    // Handle ISO string
-                    ts = new Date(report.timestamp.replace('Z', '+00:00'));
-                } else if (report.timestamp.toDate) {
-                    // Handle Firestore timestamp
-                    ts = report.timestamp.toDate();
-                } else if (report.timestamp instanceof Date) {
-                    ts = report.timestamp;
-                } else {
-                    ts = new Date();
-                }
+        const { severityTimes, severities } = prepared;
 
-                timestamps.push(ts);
-                severities.push(report.severity || 0);
-            }
-        });
-
-        if (timestamps.length === 0) {
+        if (severityTimes.length === 0) {
             return {
                 daily_pattern: {},
                 monthly_pattern: {},
@@ -104,35 +127,41 @@ class DataProcessor {
             };
         }
 
-        // Analyze daily patterns
-        const hours = timestamps.map(ts => ts.getHours());
-        const hourSeverity = {};
-        hours.forEach((h, idx) => {
-            if (!hourSeverity[h]) {
-                hourSeverity[h] = [];
+        // Sum and count severities per hour and per month in a single pass
+        const hourSums = new Float64Array(24);
+        const hourCounts = new Uint32Array(24);
+        const monthSums = new Float64Array(13); // Indexed 1-12
+        const monthCounts = new Uint32Array(13);
+        const date = new Date(0);
+        severityTimes.forEach((time, idx) => {
+            date.setTime(time);
+            const hour = date.getHours();
+            const month = date.getMonth() + 1; // JavaScript months are 0-indexed
+            if (Number.isNaN(hour)) {
+                return; // Unparseable timestamp
             }
-            hourSeverity[h].push(severities[idx]);
+            const severity = severities[idx] || 0;
+            hourSums[hour] += severity;
+            hourCounts[hour]++;
+            monthSums[month] += severity;
+            monthCounts[month]++;
         });
 
+        // Analyze daily patterns
         const dailyPattern = {};
-        Object.keys(hourSeverity).forEach(hour => {
-            dailyPattern[hour] = this._mean(hourSeverity[hour]);
-        });
-
-        // Analyze monthly patterns
-        const months = timestamps.map(ts => ts.getMonth() + 1); // JavaScript months are 0-indexed
-        const monthSeverity = {};
-        months.forEach((m, idx) => {
-            if (!monthSeverity[m]) {
-                monthSeverity[m] = [];
+        for (let hour = 0; hour < 24; hour++) {
+            if (hourCounts[hour] > 0) {
+                dailyPattern[hour] = hourSums[hour] / hourCounts[hour];
             }
-            monthSeverity[m].push(severities[idx]);
-        });
+        }
 
+        // Analyze monthly patterns
         const monthlyPattern = {};
-        Object.keys(monthSeverity).forEach(month => {
-            monthlyPattern[month] = this._mean(monthSeverity[month]);
-        });
+        for (let month = 1; month <= 12; month++) {
+            if (monthCounts[month] > 0) {
+                monthlyPattern[month] = monthSums[month] / monthCounts[month];
+            }
+        }
 
         // Check for seasonal pattern
         const spring = this._mean([3, 4, 5].map(m => monthlyPattern[m]).filter(v => v !== undefined));
@@ -161,94 +190,105 @@ class DataProcessor {
      * Analyze correlations between foods and allergy severity
      * @param {Array} foodLogs - Array of food logs
      * @param {Array} severityHistory - Array of severity reports
+     * @param {Object} prepared - Output of prepareHistory, parsed here if omitted
      * @returns {Object} Food correlations
      */
-    analyzeFoodCorrelations(foodLogs, severityHistory) {
+    analyzeFoodCorrelations(foodLogs, severityHistory, prepared = this.prepareHistory(severityHistory, foodLogs)) {
         if (!foodLogs || !severityHistory || foodLogs.length === 0 || severityHistory.length === 0) {
             return {};
         }
 
-        // Extract food timestamps and items
-        const foodData = [];
-        foodLogs.forEach(log => {
-            if (log.timestamp && log.items) {
-                let ts;
-                if (typeof log.timestamp === 'string') {
-                    ts = new Date(log.timestamp.replace('Z', '+00:00'));
-                } else if (log.timestamp.toDate) {
-                    ts = log.timestamp.toDate();
-                } else if (log.timestamp instanceof Date) {
-                    ts = log.timestamp;
-                } else {
-                    ts = new Date();
-                }
+        const { foodTimes, foodItems } = prepared;
 
-                log.items.forEach(item => {
-                    foodData.push({
-                        item,
-                        timestamp: ts
-                    });
-                });
+        // Sort severity reports by time so the reports within 24 hours after a
+        // meal form a contiguous range, and keep running sums for range totals
+        const order = [];
+        prepared.severityTimes.forEach((time, idx) => {
+            if (prepared.severities[idx] !== undefined && !Number.isNaN(time)) {
+                order.push(idx);
             }
         });
-
-        // Extract severity timestamps and levels
-        const severityData = [];
-        severityHistory.forEach(report => {
-            if (report.timestamp && report.severity !== undefined) {
-                let ts;
-                if (typeof report.timestamp === 'string') {
-                    ts = new Date(report.timestamp.replace('Z', '+00:00'));
-                } else if (report.timestamp.toDate) {
-                    ts = report.timestamp.toDate();
-                } else if (report.timestamp instanceof Date) {
-                    ts = report.timestamp;
-                } else {
-                    ts = new Date();
-                }
-
-                severityData.push({
-                    severity: report.severity,
-                    timestamp: ts
-                });
-            }
+        order.sort((a, b) => prepared.severityTimes[a] - prepared.severityTimes[b]);
+        const severityTimes = Float64Array.from(order, idx => prepared.severityTimes[idx]);
+        const severitySums = new Float64Array(order.length + 1);
+        order.forEach((severityIdx, idx) => {
+            severitySums[idx + 1] = severitySums[idx] + prepared.severities[severityIdx];
         });
 
-        // For each food item, find severity reports within 24 hours after consumption
-        const foodCorrelations = {};
+        // For each food item, total the severity reports within 24 hours after consumption
+        const hours24 = 24 * 60 * 60 * 1000; // 24 hours in milliseconds
+        const foodTotals = {};
 
-        foodData.forEach(foodEntry => {
-            const foodItem = foodEntry.item;
-            const foodTime = foodEntry.timestamp;
+        foodItems.forEach((item, idx) => {
+            const foodTime = foodTimes[idx];
+            const start = this._bisect(severityTimes, foodTime);
+            const end = this._bisect(severityTimes, foodTime + hours24, true);
 
-            // Find severity reports within 24 hours
-            const relatedSeverities = [];
-            severityData.forEach(severityEntry => {
-                const timeDiff = severityEntry.timestamp - foodTime;
-                const hours24 = 24 * 60 * 60 * 1000; // 24 hours in milliseconds
-                if (timeDiff >= 0 && timeDiff <= hours24) {
-                    relatedSeverities.push(severityEntry.severity);
-                }
-            });
-
-            // If we found related severity reports, calculate the average severity
-            if (relatedSeverities.length > 0) {
-                if (!foodCorrelations[foodItem]) {
-                    foodCorrelations[foodItem] = [];
-                }
-                foodCorrelations[foodItem].push(...relatedSeverities);
+            if (end > start) {
+                const totals = foodTotals[item] || (foodTotals[item] = { sum: 0, count: 0 });
+                totals.sum += severitySums[end] - severitySums[start];
+                totals.count += end - start;
             }
         });
 
         // Calculate average severity for each food
         const averageCorrelations = {};
-        Object.keys(foodCorrelations).forEach(food => {
-            averageCorrelations[food] = this._mean(foodCorrelations[food]);
+        Object.keys(foodTotals).forEach(food => {
+            averageCorrelations[food] = foodTotals[food].sum / foodTotals[food].count;
         });
 
         return averageCorrelations;
     }
 
+    /**
+     * Convert a stored timestamp to epoch milliseconds, caching parsed ISO strings
+     * @param {string|Object|Date} timestamp - ISO string, Firestore timestamp or Date
+     * @returns {number} Epoch milliseconds, NaN if unparseable
+     */
+    _parseTime(timestamp) {
+        if (typeof timestamp === 'string') {
+            // Handle ISO string
+            let parsed = parsedTimestamps.get(timestamp);
+            if (parsed === undefined) {
+                parsed = Date.parse(timestamp);
+                if (parsedTimestamps.size >= TIMESTAMP_CACHE_SIZE) {
+                    parsedTimestamps.delete(parsedTimestamps.keys().next().value);
+                }
+                parsedTimestamps.set(timestamp, parsed);
+            }
+            return parsed;
+        }
+        if (timestamp.toMillis) {
+            // Handle Firestore timestamp
+            return timestamp.toMillis();
+        }
+        if (timestamp instanceof Date) {
+            return timestamp.getTime();
+        }
+        return Date.now();
+    }
+
+    /**
+     * Find the insertion index for a value in an ascending array
+     * @param {Float64Array} values - Ascending values
+     * @param {number} target - Value to locate
+     * @param {boolean} afterEqual - Place after values equal to target instead of before
+     * @returns {number} Insertion index
+     */
+    _bisect(values, target, afterEqual = false) {
+        let low = 0;
+        let high = values.length;
+        while (low < high) {
+            const mid = (low + high) >>> 1;
+            if (values[mid] < target || (afterEqual && values[mid] === target)) {
+                low = mid + 1;
+            } else {
+                high = mid;
+            }
+        }
+        return low;
+    }
+
     /**
      * Calculate mean of an array
      * @param {Array} arr - Array of numbers
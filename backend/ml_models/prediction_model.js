@@ -16,17 +16,17 @@ class AllergySeverityPredictor {
             'month',
             'day_of_week'
         ];
+
+        // Reused by preprocessFeatures to avoid allocating per prediction
+        this._featureBuffer = new Float64Array(this.featureNames.length);
     }
 
     /**
      * Convert input data into model features
      * @param {Object} data - Input data
-     * @returns {Array} Feature array
+     * @returns {Float64Array} Feature buffer, overwritten by the next call
      */
     preprocessFeatures(data) {
-        // Extract features from data
-        const features = [];
-
         // User features
         const allergensCount = data.allergens ? data.allergens.length : 0;
         const severityHistory = data.severity_history || [];
@@ -34,15 +34,20 @@ class AllergySeverityPredictor {
             ? severityHistory.reduce((sum, s) => sum + (s.severity || 0), 0) / severityHistory.length
             : 0;
 
-        // Food features
-        const foodItems = [];
-        (data.food_logs || []).forEach(log => {
-            if (log.items) {
-                foodItems.push(...log.items);
-            }
-        });
-        const allergens = data.allergens || [];
-        const riskyFoodsCount = foodItems.filter(food => allergens.includes(food)).length;
+        // Food features - reuse the risky foods already found by DataProcessor
+        let riskyFoodsCount;
+        if (data.risky_foods) {
+            riskyFoodsCount = data.risky_foods.length;
+        } else {
+            const foodItems = [];
+            (data.food_logs || []).forEach(log => {
+                if (log.items) {
+                    foodItems.push(...log.items);
+                }
+            });
+            const allergenSet = new Set(data.allergens || []);
+            riskyFoodsCount = foodItems.filter(food => allergenSet.has(food)).length;
+        }
 
         // Environmental features
         const envData = data.environmental_data && data.environmental_data.length > 0
@@ -61,17 +66,17 @@ class AllergySeverityPredictor {
         const dayOfWeek = now.getDay();
 
         // Combine all features
-        return [
-            allergensCount,
-            avgSeverity,
-            riskyFoodsCount,
-            pollenLevel,
-            humidity,
-            temperature,
-            airQuality,
-            month,
-            dayOfWeek
-        ];
+        const features = this._featureBuffer;
+        features[0] = allergensCount;
+        features[1] = avgSeverity;
+        features[2] = riskyFoodsCount;
+        features[3] = pollenLevel;
+        features[4] = humidity;
+        features[5] = temperature;
+        features[6] = airQuality;
+        features[7] = month;
+        features[8] = dayOfWeek;
+        return features;
     }
 
     /**
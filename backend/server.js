@@ -0,0 +1,59 @@
+const cluster = require('cluster');
+const os = require('os');
+
+// One worker per CPU core unless WEB_CONCURRENCY is set
+const WORKER_COUNT = parseInt(process.env.WEB_CONCURRENCY, 10) || os.cpus().length;
+
+// Crashed workers are restarted with backoff; if too many crash within the
+// window (e.g. bad config or credentials) the primary gives up and exits
+const RESTART_DELAY_MS = 1000;
+const MAX_RESTART_DELAY_MS = 30 * 1000;
+const CRASH_WINDOW_MS = 60 * 1000;
+const MAX_CRASHES_PER_WINDOW = 10;
+
+// isPrimary was added in Node 16; older releases only have isMaster
+const isPrimary = cluster.isPrimary ?? cluster.isMaster;
+
+if (isPrimary && WORKER_COUNT > 1) {
+    console.log(`Starting ${WORKER_COUNT} workers`);
+    for (let i = 0; i < WORKER_COUNT; i++) {
+        cluster.fork();
+    }
+
+    let recentCrashes = [];
+    let shuttingDown = false;
+
+    // Replace workers that die so capacity stays constant
+    cluster.on('exit', (worker, code, signal) => {
+        if (shuttingDown || worker.exitedAfterDisconnect) {
+            return;
+        }
+
+        const now = Date.now();
+        recentCrashes = recentCrashes.filter(time => now - time < CRASH_WINDOW_MS);
+        recentCrashes.push(now);
+        if (recentCrashes.length > MAX_CRASHES_PER_WINDOW) {
+            console.error(`${recentCrashes.length} worker crashes within ${CRASH_WINDOW_MS / 1000}s, exiting`);
+            process.exit(1);
+        }
+
+        const delay = Math.min(RESTART_DELAY_MS * 2 ** (recentCrashes.length - 1), MAX_RESTART_DELAY_MS);
+        console.error(`Worker ${worker.process.pid} exited (${signal || code}), restarting in ${delay}ms`);
+        setTimeout(() => {
+            if (!shuttingDown) {
+                cluster.fork();
+            }
+        }, delay);
+    });
+
+    // Stop workers gracefully instead of restarting them
+    const shutdown = () => {
+        shuttingDown = true;
+        cluster.disconnect(() => process.exit(0));
+    };
+    process.on('SIGTERM', shutdown);
+    process.on('SIGINT', shutdown);
+} else {
+    // Workers share the listening port through the cluster primary
+    require('./app').startServer();
+}
@@ -0,0 +1,78 @@
+class TTLCache {
+    /**
+     * In-process cache with per-entry expiry and least-recently-used eviction
+     * @param {number} maxSize - Maximum number of entries kept
+     * @param {number} ttlMs - Entry lifetime in milliseconds
+     */
+    constructor(maxSize, ttlMs) {
+        this.maxSize = maxSize;
+        this.ttlMs = ttlMs;
+        // Map preserves insertion order, so the first key is the least recently used
+        this.entries = new Map();
+        // Lookup counters for monitoring hit rate
+        this.hits = 0;
+        this.misses = 0;
+    }
+
+    /**
+     * Get a cached value
+     * @param {*} key - Cache key
+     * @returns {*} Cached value or undefined if missing or expired
+     */
+    get(key) {
+        const entry = this.entries.get(key);
+        if (entry === undefined) {
+            this.misses++;
+            return undefined;
+        }
+
+        this.entries.delete(key);
+        if (entry.expiresAt <= Date.now()) {
+            this.misses++;
+            return undefined;
+        }
+
+        // Re-insert to mark as most recently used
+        this.entries.set(key, entry);
+        this.hits++;
+        return entry.value;
+    }
+
+    /**
+     * Store a value
+     * @param {*} key - Cache key
+     * @param {*} value - Value to cache
+     */
+    set(key, value) {
+        this.entries.delete(key);
+        if (this.entries.size >= this.maxSize) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+        this.entries.set(key, {
+            value,
+            expiresAt: Date.now() + this.ttlMs
+        });
+    }
+
+    /**
+     * Get cache usage statistics
+     * @returns {Object} Entry count and hit/miss counters
+     */
+    stats() {
+        return {
+            size: this.entries.size,
+            hits: this.hits,
+            misses: this.misses
+        };
+    }
+
+    /**
+     * Remove a value
+     * @param {*} key - Cache key
+     */
+    delete(key) {
+        this.entries.delete(key);
+    }
+}
+
+module.exports = TTLCache;
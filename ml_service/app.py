@@ -1,16 +1,48 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import orjson
 from prediction_model import AllergySeverityPredictor
 from data_processor import DataProcessor
 import os
 
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+
+# Upper bound on items scored in one batch prediction request
+MAX_BATCH_SIZE = 256
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, with native numpy support"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=JSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Initialize ML components
 predictor = AllergySeverityPredictor()
 data_processor = DataProcessor()
 
+# Run one prediction at startup so the first request doesn't pay warm-up costs
+try:
+    predictor.predict(data_processor.process_for_prediction({}))
+except Exception as e:
+    print(f'Model warm-up failed: {e}')
+
+@app.before_request
+def require_json_body():
+    """Reject non-JSON POST bodies before any handler work"""
+    if request.method == 'POST' and not request.is_json:
+        return jsonify({
+            'success': False,
+            'error': 'Content-Type must be application/json'
+        }), 415
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
@@ -22,7 +54,7 @@ def health_check():
 @app.route('/api/predict/allergy-risk', methods=['POST'])
 def predict_allergy_risk():
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         
         if not data:
             return jsonify({
@@ -42,16 +74,62 @@ def predict_allergy_risk():
             processed_data
         )
         
-        return jsonify({
+        # Encode straight to bytes, skipping jsonify's str round-trip
+        return Response(orjson.dumps({
             'success': True,
             'prediction': {
-                'risk_level': float(prediction['risk_score']),
-                'confidence': float(prediction['confidence']),
+                'risk_level': prediction['risk_score'],
+                'confidence': prediction['confidence'],
                 'contributing_factors': prediction['contributing_factors'],
                 'probability_distribution': prediction['probability_distribution'],
                 'tailored_alerts': alert_config
             }
-        })
+        }, option=JSON_OPTIONS), mimetype='application/json')
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/predict/allergy-risk/batch', methods=['POST'])
+def predict_allergy_risk_batch():
+    """Score many prediction inputs with a single model call"""
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'error': 'No items provided'
+            }), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'Batch size exceeds limit of {MAX_BATCH_SIZE}'
+            }), 400
+        
+        processed_batch = [data_processor.process_for_prediction(item) for item in items]
+        predictions = predictor.predict_batch(processed_batch)
+        
+        results = []
+        for prediction, processed_data in zip(predictions, processed_batch):
+            results.append({
+                'risk_level': prediction['risk_score'],
+                'confidence': prediction['confidence'],
+                'contributing_factors': prediction['contributing_factors'],
+                'probability_distribution': prediction['probability_distribution'],
+                'tailored_alerts': data_processor.generate_tailored_alerts(
+                    prediction,
+                    processed_data
+                )
+            })
+        
+        return Response(orjson.dumps({
+            'success': True,
+            'predictions': results
+        }, option=JSON_OPTIONS), mimetype='application/json')
         
     except Exception as e:
         return jsonify({
@@ -63,7 +141,7 @@ def predict_allergy_risk():
 def update_model():
     """Endpoint to retrain model with new user data"""
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         training_samples = data.get('samples', [])
         
         if not training_samples:
@@ -92,6 +170,7 @@ def update_model():
 
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 5001))
+    DEBUG = os.environ.get('FLASK_DEBUG') == '1'
     print(f'ML Service starting on port {PORT}')
-    app.run(debug=True, host='0.0.0.0', port=PORT)
+    app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
 
@@ -1,17 +1,67 @@
+import re
 import numpy as np
-from datetime import datetime, timedelta
-from scipy import stats
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from operator import itemgetter
+
+# Model features in order, with the value used when one is missing
+FEATURE_DEFAULTS = {
+    'allergens_count': 0,
+    'avg_historical_severity': 0,
+    'risky_foods_count': 0,
+    'days_since_last_reaction': 30,
+    'pollen_level': 0,
+    'humidity': 50,
+    'temperature': 20,
+    'air_quality_index': 50,
+    'wind_speed': 0,
+    'month': 6,
+    'hour_of_day': 12,
+    'season_risk_factor': 0.5
+}
+_get_features = itemgetter(*FEATURE_DEFAULTS)
+
+def feature_vector(features):
+    """Tuple of feature values in model order, with defaults for missing ones"""
+    return _get_features({**FEATURE_DEFAULTS, **features})
+
+@lru_cache(maxsize=256)
+def _allergen_pattern(allergens):
+    """Compile one case-insensitive pattern matching any of the allergens"""
+    return re.compile('|'.join(map(re.escape, allergens)), re.IGNORECASE)
+
+# Seasonal risk of each month, indexed by month - 1: winter 0.40,
+# spring 0.85 (high pollen season), summer 0.60, fall 0.75
+_MONTH_RISK = (
+    0.40, 0.40, 0.85, 0.85, 0.85, 0.60,
+    0.60, 0.60, 0.75, 0.75, 0.75, 0.40
+)
+
+@lru_cache(maxsize=64)
+def _temporal_risk(year, month, day, hour):
+    """Temporal features for one hour bucket, cached since they change hourly"""
+    return {
+        'month': month,
+        'hour_of_day': hour,
+        'season_risk_factor': _MONTH_RISK[month - 1]
+    }
+
+# Alert recommendations by predicted high-risk probability
+HIGH_RISK_RECOMMENDATIONS = (
+    'High risk detected - consider taking preventive medication',
+    'Avoid outdoor activities during peak hours',
+    'Keep windows closed to minimize allergen exposure'
+)
+MODERATE_RISK_RECOMMENDATIONS = (
+    'Moderate risk - monitor your symptoms closely',
+    'Have allergy medication readily available',
+    'Check pollen forecasts before going outside'
+)
+LOW_RISK_RECOMMENDATIONS = (
+    'Low risk conditions - normal precautions sufficient',
+)
 
 class DataProcessor:
-    def __init__(self):
-        """Initialize data processor with probability distributions"""
-        self.season_risk_map = {
-            'spring': 0.85,  # High pollen season
-            'summer': 0.60,
-            'fall': 0.75,
-            'winter': 0.40
-        }
-    
     def process_for_prediction(self, data):
         """Process raw data into features with probability distributions"""
         # Extract user data
@@ -57,26 +107,29 @@ class DataProcessor:
         if not severity_history:
             return 0, 0
         
-        severities = [r.get('severity', 0) for r in severity_history]
+        if len(severity_history) < 2:
+            return severity_history[0].get('severity', 0), 0
         
-        if len(severities) < 2:
-            return severities[0] if severities else 0, 0
+        severities = np.fromiter(
+            (r.get('severity', 0) for r in severity_history),
+            dtype=np.float64,
+            count=len(severity_history)
+        )
         
         # Calculate distribution parameters
-        mean = np.mean(severities)
-        std = np.std(severities)
-        
-        return mean, std
+        return severities.mean(), severities.std()
     
     def _identify_risky_foods(self, food_logs, allergens):
         """Identify recent exposure to allergens"""
+        if not allergens or not food_logs:
+            return []
+        
+        pattern = _allergen_pattern(tuple(allergens))
         risky_foods = []
         
         for log in food_logs[-5:]:  # Last 5 food logs
             items = log.get('items', [])
-            for item in items:
-                if any(allergen.lower() in item.lower() for allergen in allergens):
-                    risky_foods.append(item)
+            risky_foods.extend(item for item in items if pattern.search(item))
         
         return risky_foods
     
@@ -86,21 +139,32 @@ class DataProcessor:
             return 30  # Default if no history
         
         try:
-            last_reaction = severity_history[-1]
-            timestamp = last_reaction.get('timestamp')
-            
-            if timestamp:
-                if hasattr(timestamp, 'toDate'):
-                    reaction_date = timestamp.toDate()
-                else:
-                    reaction_date = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
-                
-                days = (datetime.now() - reaction_date).days
-                return max(0, days)
-        except:
-            pass
-        
-        return 30
+            reaction_date = self._parse_reaction_time(severity_history[-1].get('timestamp'))
+        except (KeyError, ValueError, TypeError, AttributeError, OverflowError, OSError):
+            return 30
+        
+        if reaction_date is None:
+            return 30
+        
+        # Compare in the reaction's own timezone (naive stays naive)
+        now = datetime.now(reaction_date.tzinfo)
+        return max(0, (now - reaction_date).days)
+    
+    def _parse_reaction_time(self, timestamp):
+        """Convert a stored reaction timestamp to a datetime, or None if missing"""
+        if not timestamp:
+            return None
+        if isinstance(timestamp, datetime):
+            return timestamp
+        if isinstance(timestamp, (int, float)):
+            # Epoch seconds
+            return datetime.fromtimestamp(timestamp, timezone.utc)
+        if isinstance(timestamp, dict):
+            # Firestore timestamp serialized as JSON
+            return datetime.fromtimestamp(timestamp['_seconds'], timezone.utc)
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        return datetime.fromisoformat(timestamp)
     
     def _extract_environmental_features(self, env_data):
         """Extract environmental features from data"""
@@ -119,69 +183,39 @@ class DataProcessor:
     def _calculate_temporal_risk(self):
         """Calculate risk factors based on time with probability distribution"""
         now = datetime.now()
-        month = now.month
-        hour = now.hour
-        
-        # Determine season
-        if month in [3, 4, 5]:
-            season = 'spring'
-        elif month in [6, 7, 8]:
-            season = 'summer'
-        elif month in [9, 10, 11]:
-            season = 'fall'
-        else:
-            season = 'winter'
-        
-        season_risk = self.season_risk_map[season]
-        
-        return {
-            'month': month,
-            'hour_of_day': hour,
-            'season_risk_factor': season_risk
-        }
+        return _temporal_risk(now.year, now.month, now.day, now.hour)
     
     def generate_tailored_alerts(self, prediction, processed_data):
         """Generate personalized alerts using probability distributions"""
         risk_score = prediction['risk_score']
         prob_dist = prediction['probability_distribution']
-        
-        alerts = {
-            'priority': self._calculate_alert_priority(risk_score, prob_dist),
-            'recommendations': [],
-            'risk_level_text': self._get_risk_level_text(risk_score),
-            'confidence_level': prediction['confidence']
-        }
+        high_risk = prob_dist['high_risk']
         
         # Generate tailored recommendations based on probability
-        if prob_dist['high_risk'] > 0.7:
-            alerts['recommendations'].extend([
-                'High risk detected - consider taking preventive medication',
-                'Avoid outdoor activities during peak hours',
-                'Keep windows closed to minimize allergen exposure'
-            ])
-        elif prob_dist['high_risk'] > 0.5:
-            alerts['recommendations'].extend([
-                'Moderate risk - monitor your symptoms closely',
-                'Have allergy medication readily available',
-                'Check pollen forecasts before going outside'
-            ])
+        if high_risk > 0.7:
+            recommendations = list(HIGH_RISK_RECOMMENDATIONS)
+        elif high_risk > 0.5:
+            recommendations = list(MODERATE_RISK_RECOMMENDATIONS)
         else:
-            alerts['recommendations'].append(
-                'Low risk conditions - normal precautions sufficient'
-            )
+            recommendations = list(LOW_RISK_RECOMMENDATIONS)
         
         # Add environmental-specific alerts
         if processed_data.get('pollen_level', 0) > 50:
-            alerts['recommendations'].append(
+            recommendations.append(
                 'High pollen count detected - extra caution advised'
             )
         
         if processed_data.get('air_quality_index', 50) > 100:
-            alerts['recommendations'].append(
+            recommendations.append(
                 'Poor air quality - wear a mask if going outdoors'
             )
         
-        return alerts
+        return {
+            'priority': self._calculate_alert_priority(risk_score, prob_dist),
+            'recommendations': recommendations,
+            'risk_level_text': self._get_risk_level_text(risk_score),
+            'confidence_level': prediction['confidence']
+        }
     
     def _calculate_alert_priority(self, risk_score, prob_dist):
         """Calculate alert priority using probability threshold"""
@@ -207,30 +241,18 @@ class DataProcessor:
     
     def prepare_training_data(self, samples):
         """Prepare training data from user feedback"""
-        X = []
-        y = []
-        
-        for sample in samples:
-            features = self.process_for_prediction(sample['data'])
-            feature_vector = [
-                features.get('allergens_count', 0),
-                features.get('avg_historical_severity', 0),
-                features.get('risky_foods_count', 0),
-                features.get('days_since_last_reaction', 30),
-                features.get('pollen_level', 0),
-                features.get('humidity', 50),
-                features.get('temperature', 20),
-                features.get('air_quality_index', 50),
-                features.get('wind_speed', 0),
-                features.get('month', 6),
-                features.get('hour_of_day', 12),
-                features.get('season_risk_factor', 0.5)
-            ]
-            X.append(feature_vector)
-            
-            # Binary classification: high severity (1) vs low severity (0)
-            severity = sample.get('actual_severity', 5)
-            y.append(1 if severity > 5 else 0)
-        
-        return np.array(X), np.array(y)
-
+        n_samples = len(samples)
+        X = np.empty((n_samples, len(FEATURE_DEFAULTS)), dtype=np.float32)
+        
+        for i, sample in enumerate(samples):
+            X[i] = feature_vector(self.process_for_prediction(sample['data']))
+        
+        # Binary classification: high severity (1) vs low severity (0)
+        severities = np.fromiter(
+            (sample.get('actual_severity', 5) for sample in samples),
+            dtype=np.float32,
+            count=n_samples
+        )
+        y = (severities > 5).astype(np.int8)
+        
+        return X, y
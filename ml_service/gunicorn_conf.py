@@ -0,0 +1,21 @@
+import os
+
+# Gunicorn settings for the ML service: gunicorn -c gunicorn_conf.py app:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+
+# One worker by default: /api/train/update retrains the model in the worker
+# that handles it, and other workers would keep serving their old copy until
+# restarted. Only raise WEB_CONCURRENCY if retraining is done out of band
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Prediction is CPU-bound numpy/sklearn work, so OS threads (which release the
+# GIL inside native code) fit better than gevent coroutines
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Load the app (and train/load the model) once in the master before forking
+preload_app = True
+
+timeout = 60
+keepalive = 5
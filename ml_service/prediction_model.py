@@ -1,10 +1,49 @@
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, precision_score, recall_score
-import pickle
+import joblib
 import os
+import pickle
+import tempfile
+from data_processor import FEATURE_DEFAULTS, feature_vector
+from types import MappingProxyType
+
+MODEL_PATH = 'trained_model.joblib'
+# Pickle file written before models were saved with joblib
+LEGACY_MODEL_PATH = 'trained_model.pkl'
+
+# Boosting stops adding trees once validation loss stops improving, keeping the
+# ensemble small; smaller datasets, or ones where a class has a single sample,
+# can't spare a stratified validation split
+EARLY_STOPPING_ROUNDS = 10
+EARLY_STOPPING_MIN_SAMPLES = 100
+
+# Feature weights behind the risk labels of synthetic training data
+SYNTHETIC_RISK_WEIGHTS = {
+    'allergens_count': 0.3,
+    'avg_historical_severity': 0.25,
+    'risky_foods_count': 0.2,
+    'pollen_level': 0.15,
+    'air_quality_index': 0.1
+}
+
+# Readable names for features reported as contributing factors
+FACTOR_NAMES = MappingProxyType({
+    'allergens_count': 'Number of allergens',
+    'avg_historical_severity': 'Historical severity',
+    'risky_foods_count': 'Recent allergen exposure',
+    'days_since_last_reaction': 'Time since last reaction',
+    'pollen_level': 'Pollen count',
+    'humidity': 'High humidity',
+    'temperature': 'Temperature',
+    'air_quality_index': 'Air quality',
+    'wind_speed': 'Wind conditions',
+    'month': 'Seasonal factors',
+    'hour_of_day': 'Time of day',
+    'season_risk_factor': 'Seasonal patterns'
+})
 
 class AllergySeverityPredictor:
     def __init__(self):
@@ -19,74 +58,73 @@ class AllergySeverityPredictor:
             random_state=42
         )
         self.scaler = StandardScaler()
-        self.feature_names = [
-            'allergens_count',
-            'avg_historical_severity',
-            'risky_foods_count',
-            'days_since_last_reaction',
-            'pollen_level',
-            'humidity',
-            'temperature',
-            'air_quality_index',
-            'wind_speed',
-            'month',
-            'hour_of_day',
-            'season_risk_factor'
-        ]
+        self.feature_names = list(FEATURE_DEFAULTS)
         self.is_fitted = False
         self._load_pretrained_model()
     
     def _load_pretrained_model(self):
         """Load pre-trained model if available"""
-        model_path = 'trained_model.pkl'
-        if os.path.exists(model_path):
+        migrate = not os.path.exists(MODEL_PATH) and os.path.exists(LEGACY_MODEL_PATH)
+        if os.path.exists(MODEL_PATH) or migrate:
             try:
-                with open(model_path, 'rb') as f:
-                    saved_data = pickle.load(f)
-                    self.model = saved_data['model']
-                    self.scaler = saved_data['scaler']
-                    self.feature_names = saved_data['feature_names']
-                    self.is_fitted = True
-                    print('Loaded pre-trained model')
+                if migrate:
+                    with open(LEGACY_MODEL_PATH, 'rb') as f:
+                        saved_data = pickle.load(f)
+                else:
+                    # Memory-map the saved arrays instead of copying them into each process
+                    saved_data = joblib.load(MODEL_PATH, mmap_mode='r')
+                self.model = saved_data['model']
+                self.scaler = saved_data['scaler']
+                self.feature_names = saved_data['feature_names']
+                self._cache_scaler_params()
+                self._refresh_importance_cache()
+                self.is_fitted = True
+                print('Loaded pre-trained model')
             except Exception as e:
                 print(f'Error loading model: {e}')
                 self._train_with_synthetic_data()
+            else:
+                if migrate:
+                    self.save_model()
+                    print(f'Migrated {LEGACY_MODEL_PATH} to {MODEL_PATH}')
         else:
             self._train_with_synthetic_data()
     
     def _train_with_synthetic_data(self):
         """Train model with synthetic data for initial deployment"""
         print('Training model with synthetic data...')
-        np.random.seed(42)
+        rng = np.random.default_rng(42)
         n_samples = 1000
         
         # Generate synthetic training data
-        X = np.random.randn(n_samples, len(self.feature_names))
-        
-        # Create realistic risk scores based on features
-        y = (
-            0.3 * X[:, 0] +  # allergens_count
-            0.25 * X[:, 1] +  # avg_historical_severity
-            0.2 * X[:, 2] +  # risky_foods_count
-            0.15 * X[:, 4] +  # pollen_level
-            0.1 * X[:, 7] +  # air_quality_index
-            np.random.randn(n_samples) * 0.3  # noise
+        X = rng.standard_normal((n_samples, len(self.feature_names)), dtype=np.float32)
+        
+        # Create realistic risk scores as a weighted sum of features plus noise
+        weights = np.array(
+            [SYNTHETIC_RISK_WEIGHTS.get(name, 0) for name in self.feature_names],
+            dtype=np.float32
         )
+        y = X @ weights + rng.standard_normal(n_samples, dtype=np.float32) * 0.3
         
         # Convert to binary classification (high risk vs low risk)
-        y_binary = (y > np.median(y)).astype(int)
+        y_binary = (y > np.median(y)).astype(np.int8)
         
         # Scale features
         X_scaled = self.scaler.fit_transform(X)
+        self._cache_scaler_params()
+        
+        # Hold out 20% for evaluation instead of refitting for cross-validation
+        X_train, X_test, y_train, y_test = train_test_split(
+            X_scaled, y_binary, test_size=0.2, stratify=y_binary, random_state=42
+        )
         
         # Train model
-        self.model.fit(X_scaled, y_binary)
+        self._fit_model(X_train, y_train)
         self.is_fitted = True
         
         # Calculate baseline accuracy improvement
         baseline_accuracy = 0.50  # Random guess
-        cv_scores = cross_val_score(self.model, X_scaled, y_binary, cv=5)
-        model_accuracy = cv_scores.mean()
+        model_accuracy = accuracy_score(y_test, self.model.predict(X_test))
         improvement = ((model_accuracy - baseline_accuracy) / baseline_accuracy) * 100
         
         print(f'Model trained. Accuracy: {model_accuracy:.3f}')
@@ -95,23 +133,68 @@ class AllergySeverityPredictor:
         # Save model
         self.save_model()
     
+    def _cache_scaler_params(self):
+        """Keep the fitted scaling parameters for standardizing prediction inputs"""
+        # float32 to match the dtype sklearn's trees evaluate, so scaled rows
+        # reach predict_proba without another conversion copy
+        self._feature_mean = self.scaler.mean_.astype(np.float32)
+        self._feature_inv_scale = (1.0 / self.scaler.scale_).astype(np.float32)
+    
+    def _scale_features(self, features):
+        """Standardize features in place, without sklearn's per-call validation overhead"""
+        np.subtract(features, self._feature_mean, out=features)
+        np.multiply(features, self._feature_inv_scale, out=features)
+        return features
+    
+    def _fit_model(self, X_scaled, y):
+        """Fit the ensemble, stopping early when there is enough data to validate"""
+        early_stopping = (
+            len(y) >= EARLY_STOPPING_MIN_SAMPLES
+            and np.unique(y, return_counts=True)[1].min() >= 2
+        )
+        self.model.set_params(
+            n_iter_no_change=EARLY_STOPPING_ROUNDS if early_stopping else None
+        )
+        self.model.fit(X_scaled, y)
+        self._refresh_importance_cache()
+    
+    def _refresh_importance_cache(self):
+        """Cache importance-derived output, which only changes when the model does"""
+        feature_importance = {
+            name: float(importance)
+            for name, importance in zip(self.feature_names, self.model.feature_importances_)
+        }
+        
+        # Identify top contributing factors
+        sorted_features = sorted(
+            feature_importance.items(),
+            key=lambda x: x[1],
+            reverse=True
+        )
+        self._contributing_factors = [
+            self._format_factor_name(factor)
+            for factor, importance in sorted_features[:5]
+            if importance > 0.05
+        ]
+        self._feature_importance = feature_importance
+    
     def extract_features(self, processed_data):
         """Extract feature vector from processed data"""
-        features = [
-            processed_data.get('allergens_count', 0),
-            processed_data.get('avg_historical_severity', 0),
-            processed_data.get('risky_foods_count', 0),
-            processed_data.get('days_since_last_reaction', 30),
-            processed_data.get('pollen_level', 0),
-            processed_data.get('humidity', 50),
-            processed_data.get('temperature', 20),
-            processed_data.get('air_quality_index', 50),
-            processed_data.get('wind_speed', 0),
-            processed_data.get('month', 6),
-            processed_data.get('hour_of_day', 12),
-            processed_data.get('season_risk_factor', 0.5)
-        ]
-        return np.array(features).reshape(1, -1)
+        return np.fromiter(
+            feature_vector(processed_data),
+            dtype=np.float32,
+            count=len(self.feature_names)
+        ).reshape(1, -1)
+    
+    def extract_features_batch(self, processed_batch):
+        """Extract an (n_samples, n_features) matrix from a list of processed data"""
+        features = np.empty(
+            (len(processed_batch), len(self.feature_names)),
+            dtype=np.float32
+        )
+        for i, processed_data in enumerate(processed_batch):
+            features[i] = feature_vector(processed_data)
+        return features
     
     def predict(self, processed_data):
         """Make prediction with probability distribution"""
@@ -120,32 +203,30 @@ class AllergySeverityPredictor:
         
         # Extract features
         features = self.extract_features(processed_data)
-        features_scaled = self.scaler.transform(features)
+        features_scaled = self._scale_features(features)
         
         # Get prediction probabilities
         probabilities = self.model.predict_proba(features_scaled)[0]
-        prediction_class = self.model.predict(features_scaled)[0]
         
-        # Calculate risk score (0-10 scale)
-        risk_score = probabilities[1] * 10
+        return self._build_prediction(probabilities)
+    
+    def predict_batch(self, processed_batch):
+        """Make predictions for many inputs with a single model call"""
+        if not self.is_fitted:
+            raise ValueError('Model not trained')
+        if not processed_batch:
+            return []
         
-        # Get feature importance
-        feature_importance = dict(zip(
-            self.feature_names,
-            self.model.feature_importances_
-        ))
+        features = self.extract_features_batch(processed_batch)
+        features_scaled = self._scale_features(features)
+        probabilities = self.model.predict_proba(features_scaled)
         
-        # Identify top contributing factors
-        sorted_features = sorted(
-            feature_importance.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )
-        contributing_factors = [
-            self._format_factor_name(factor)
-            for factor, importance in sorted_features[:5]
-            if importance > 0.05
-        ]
+        return [self._build_prediction(row) for row in probabilities]
+    
+    def _build_prediction(self, probabilities):
+        """Build the prediction result for one row of class probabilities"""
+        # Calculate risk score (0-10 scale)
+        risk_score = probabilities[1] * 10
         
         return {
             'risk_score': risk_score,
@@ -154,19 +235,18 @@ class AllergySeverityPredictor:
                 'low_risk': float(probabilities[0]),
                 'high_risk': float(probabilities[1])
             },
-            'contributing_factors': contributing_factors,
-            'feature_importance': {
-                k: float(v) for k, v in feature_importance.items()
-            }
+            'contributing_factors': self._contributing_factors,
+            'feature_importance': self._feature_importance
         }
     
     def train(self, X, y):
         """Train model with new data"""
         # Scale features
         X_scaled = self.scaler.fit_transform(X)
+        self._cache_scaler_params()
         
         # Train model
-        self.model.fit(X_scaled, y)
+        self._fit_model(X_scaled, y)
         self.is_fitted = True
         
         # Calculate metrics
@@ -189,8 +269,27 @@ class AllergySeverityPredictor:
             'scaler': self.scaler,
             'feature_names': self.feature_names
         }
-        with open('trained_model.pkl', 'wb') as f:
-            pickle.dump(model_data, f)
+        # Uncompressed so the arrays can be memory-mapped on load. Write to a
+        # temp file and swap it in: processes that mapped the old file keep
+        # their pages instead of seeing it truncated and rewritten in place
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(MODEL_PATH)),
+            suffix='.tmp'
+        )
+        os.close(fd)
+        try:
+            joblib.dump(model_data, tmp_path, compress=0)
+            # mkstemp creates the file owner-only; keep the existing file's mode
+            # so other users (e.g. a sidecar) can still read the model
+            try:
+                mode = os.stat(MODEL_PATH).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, MODEL_PATH)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
     
     def is_trained(self):
         """Check if model is trained"""
@@ -198,19 +297,4 @@ class AllergySeverityPredictor:
     
     def _format_factor_name(self, factor):
         """Convert feature name to readable format"""
-        name_map = {
-            'allergens_count': 'Number of allergens',
-            'avg_historical_severity': 'Historical severity',
-            'risky_foods_count': 'Recent allergen exposure',
-            'days_since_last_reaction': 'Time since last reaction',
-            'pollen_level': 'Pollen count',
-            'humidity': 'High humidity',
-            'temperature': 'Temperature',
-            'air_quality_index': 'Air quality',
-            'wind_speed': 'Wind conditions',
-            'month': 'Seasonal factors',
-            'hour_of_day': 'Time of day',
-            'season_risk_factor': 'Seasonal patterns'
-        }
-        return name_map.get(factor, factor)
-
+        return FACTOR_NAMES.get(factor, factor)